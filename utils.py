@@ -14,13 +14,15 @@ format_pat = re.compile(
     r'"(.*?)"\s+'       # Everything in "": referrer
     r'"(.*?)"\s*'       # Everything in "": user agent
 )
-path = ""
-with open("subset.csv", "w") as target:
-    writer = csv.writer(target)
-    with gzip.open(path) as source:
-        line_iter = (b.decode() for b in source)
-        match_iter = (format_pat.match(line) for line in line_iter)
-        writer.writerows((m.groups() for m in match_iter if m is not None))
+
+
+def log_to_csv(path, target_path="subset.csv"):
+    with open(target_path, "w") as target:
+        writer = csv.writer(target)
+        with gzip.open(path) as source:
+            line_iter = (b.decode() for b in source)
+            match_iter = (format_pat.match(line) for line in line_iter)
+            writer.writerows((m.groups() for m in match_iter if m is not None))
 
 
 from functools import total_ordering
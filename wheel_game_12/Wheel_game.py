@@ -17,10 +17,7 @@ class Wheel(Callable):
 
     def __call__(self, environ, start_response, *args, **kwargs):
         winner = self.spin()
-        status = '200 OK'
-        headers = [('Content-type', 'application/json; charset=utf-8')]
-        start_response(status, headers)
-        return [json.dumps(winner).encode('UTF-8')]
+        return spin_response(environ, start_response, winner)
 
     @staticmethod
     def redblack(n):
@@ -62,8 +59,23 @@ class European(Zero, Wheel):
     """欧式玩法"""
     pass
 
-american = American()
-european = European()
+# 轮盘在第一次使用时才创建，导入模块时没有副作用
+_wheels = {}
+
+
+def get_wheel(name):
+    """按名称('american'或'european')延迟创建并缓存轮盘"""
+    if name not in _wheels:
+        _wheels[name] = {"american": American, "european": European}[name]()
+    return _wheels[name]
+
+
+def __getattr__(name):
+    """兼容旧的模块级变量american和european"""
+    if name in ("american", "european"):
+        return get_wheel(name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
 # print("SPIN", american.spin())
 
 
@@ -78,10 +90,20 @@ def wheel(environ, start_response):
     # 在调用start_response之前，任何打印信息都会导致异常，所以需要设置file=sys.stderr
     print("wheel", request, file=sys.stderr)
     if request.lower().startswith('eu'):
-        winner = european.spin()
+        winner = get_wheel("european").spin()
     else:
-        winner = american.spin()
+        winner = get_wheel("american").spin()
+    return spin_response(environ, start_response, winner)
+
+
+def spin_response(environ, start_response, winner):
+    """根据Accept请求头返回JSON或二进制格式的转动结果"""
+    from wheel_game_12 import wire
     status = '200 OK'
+    if wire.accepts(environ):
+        headers = [('Content-type', wire.CONTENT_TYPE)]
+        start_response(status, headers)
+        return [wire.encode_spin(winner)]
     headers = [('Content-type', 'application/json; charset=utf-8')]
     start_response(status, headers)
     return [json.dumps(winner).encode('UTF-8')]
@@ -120,11 +142,8 @@ class Wheel00(Callable):
 
 
 # 实现REST客户端
-import http.client
-import json
-
-
 def json_get(path="/"):
+    import http.client
     rest = http.client.HTTPConnection('localhost', 8080)
     rest.request("GET", path)
     response = rest.getresponse()
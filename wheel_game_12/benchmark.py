@@ -0,0 +1,115 @@
+"""
+导入时间和冷启动时间的基准测试
+
+- 导入时间：在新的解释器中导入模块所需的时间
+- 冷启动：父进程启动一个新的解释器，到收到它的第一个响应所需的时间，不包括进程退出。
+  服务器进程创建套接字并处理第一个HTTP请求；模拟器进程和spawn方式一样导入模块，
+  然后运行Simulation的工作循环，输出第一个结果。两者的测量方式相同，可以比较
+
+python -m wheel_game_12.benchmark
+"""
+
+import sys
+import time
+import statistics
+import subprocess
+
+MODULES = [
+    "wheel_game_12.Wheel_game",
+    "wheel_game_12.game_server",
+    "wheel_game_12.simulation",
+    "wheel_game_12.tests",
+    "wheel_game_12.journal",
+    "wheel_game_12.wire",
+    "utils",
+]
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+SERVER_SCRIPT = """
+from wsgiref.simple_server import make_server
+from wheel_game_12.game_server import Roulette
+from wheel_game_12.Wheel_game import get_wheel
+httpd = make_server('localhost', 0, Roulette(get_wheel("american")))
+print(httpd.server_port, flush=True)
+httpd.handle_request()
+"""
+
+# 和spawn启动方式一样：新的解释器导入模块，然后在这个进程中运行Simulation的工作循环
+SIMULATION_SCRIPT = """
+import multiprocessing
+from wheel_game_12.simulation import Simulation
+setup_q = multiprocessing.SimpleQueue()
+result_q = multiprocessing.SimpleQueue()
+setup_q.put(("american", ("Red", 1, 1)))
+setup_q.put((None, None))
+Simulation(setup_q, result_q).run()
+print("result", result_q.get(), flush=True)
+"""
+
+
+def run(script):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], check=True,
+                            stdout=subprocess.PIPE).stdout
+    return time.perf_counter() - start, output
+
+
+def first_response(script, wait):
+    """从启动新的解释器到父进程收到第一个响应的时间，不包括进程退出"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, universal_newlines=True)
+    try:
+        wait(process)
+        return time.perf_counter() - start
+    finally:
+        process.wait()
+
+
+def server_response(process):
+    import http.client
+    port = int(process.stdout.readline())
+    rest = http.client.HTTPConnection('localhost', port)
+    rest.request("POST", "/wheel/")
+    rest.getresponse().read()
+
+
+def simulation_response(process):
+    # 跳过Simulation的start/finish输出
+    for line in process.stdout:
+        if line.startswith("result"):
+            return
+    raise RuntimeError("Simulation worker exited without a result")
+
+
+def import_time(module, repeat):
+    return statistics.median(
+        float(run(IMPORT_SCRIPT.format(module=module))[1]) for r in range(repeat)
+    )
+
+
+def server_cold_start(repeat):
+    return statistics.median(first_response(SERVER_SCRIPT, server_response)
+                             for r in range(repeat))
+
+
+def simulation_cold_start(repeat):
+    return statistics.median(first_response(SIMULATION_SCRIPT, simulation_response)
+                             for r in range(repeat))
+
+
+def main(repeat=5):
+    for module in MODULES:
+        print("import {0:28s} {1:8.2f} ms".format(module, import_time(module, repeat) * 1000))
+    print("cold start {0:26s} {1:8.2f} ms".format("server", server_cold_start(repeat) * 1000))
+    print("cold start {0:26s} {1:8.2f} ms".format("simulation", simulation_cold_start(repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,9 @@
 # 启动服务器的演示版本
-from wsgiref.simple_server import make_server
 from wheel_game_12.Wheel_game import wheel
 
 
 def roulette_server(count=1):
+    from wsgiref.simple_server import make_server
     # 创建服务器对象，这个对象会回调wheel()处理请求。
     httpd = make_server('', 8080, wheel)  #
     if count is None:
@@ -16,10 +16,14 @@ def roulette_server(count=1):
 ######################################
 # 方案二
 ######################################
+import sys
 import json
 import wsgiref.util
+import urllib.parse
+import threading
 from collections.abc import Callable
 from wheel_game_12.Wheel_game import Table
+from wheel_game_12 import wire
 
 
 class WSGI(Callable):
@@ -33,14 +37,65 @@ class RESTException(Exception):
 
 class Roulette(WSGI):
     """定义一个封装其他应用程序的WSGI应用程序"""
-    def __init__(self, wheel):
+    max_spins = 1000  # 一次批量转动的最大次数
+
+    def __init__(self, wheel, journal=None):
         self.table = Table(100)
         self.rounds = 0
         self.wheel = wheel
+        self.lock = threading.RLock()  # 多线程服务器中保护状态，保证日志顺序和修改顺序一致
+        self.journal = journal  # 可选的预写日志，见journal.py
+        if self.journal:
+            self.journal.restore(self)  # 加载快照并重放日志尾部
+
+    def mutate(self, events, apply, check=None):
+        """先写日志再修改状态，然后等待组提交完成才返回。
+        events是 (事件名称, 参数...) 的列表，apply()修改状态并返回响应需要的数据，
+        check()在写日志之前根据当前状态检查请求，不通过时抛出RESTException"""
+        if not self.journal:
+            with self.lock:
+                if check:
+                    check()
+                return apply()
+        self.journal.begin()
+        try:
+            with self.lock:
+                if check:
+                    check()
+                try:
+                    for event, *args in events:
+                        seq = getattr(self.journal, event)(*args)
+                except OSError as e:
+                    raise RESTException("500 INTERNAL_SERVER_ERROR",
+                                        "Journal {0}".format(e))
+                result = apply()
+            try:
+                self.journal.commit(seq)  # 和其他并发请求共用一次fsync
+            except OSError as e:
+                raise RESTException("500 INTERNAL_SERVER_ERROR",
+                                    "Journal {0}".format(e))
+        finally:
+            self.journal.end()
+        self.checkpoint()
+        return result
+
+    def checkpoint(self):
+        """到了快照间隔就保存快照；请求已经提交，快照失败只记录错误，下次再试"""
+        if self.journal and self.journal.snapshot_due():
+            with self.lock:
+                if self.journal.snapshot_due():
+                    try:
+                        self.journal.snapshot(self)
+                    except OSError as e:
+                        print("snapshot failed", e, file=sys.stderr)
 
     def __call__(self, environ, start_response, *args, **kwargs):
         app = wsgiref.util.shift_path_info(environ)
         try:
+            if self.journal and self.journal.failed:
+                # 内存中的状态可能包含没有持久化的修改，重启后从日志恢复
+                raise RESTException("503 SERVICE_UNAVAILABLE",
+                                    "Journal failed: {0}".format(self.journal.failed))
             if app.lower() == "player":
                 return self.player_app(environ, start_response)
             elif app.lower() == "bet":
@@ -56,86 +111,143 @@ class Roulette(WSGI):
             start_response(status, headers, sys.exc_info())
             return [repr(e.args).encode("UTF-8")]
 
+    @staticmethod
+    def respond(environ, start_response, details, encode):
+        """内容协商：客户端接受二进制格式时用encode编码，否则返回JSON"""
+        status = '200 OK'
+        if wire.accepts(environ):
+            body = encode()
+            headers = [('Content-type', wire.CONTENT_TYPE)]
+        else:
+            body = json.dumps(details).encode('UTF-8')
+            headers = [('Content-type', 'application/json; charset=utf-8')]
+        start_response(status, headers)
+        return [body]
+
     def player_app(self, environ, start_response):
         if environ['REQUEST_METHOD'] == "GET":
-            details = dict(
-                stake=self.table.stake,
-                rounds=self.rounds
-            )
-            status = '200 OK'
-            headers = [('Content-type', 'application/json;charset=utf-8')]
-            start_response(status, headers)
-            return [json.dumps(details).encode('UTF-8')]
+            with self.lock:
+                details = dict(
+                    stake=self.table.stake,
+                    rounds=self.rounds
+                )
+            return self.respond(environ, start_response, details,
+                                lambda: wire.encode_player(details['stake'], details['rounds']))
         else:
             raise RESTException("405 METHOD_NOT_ALLOWED",
                                 "Method '{REQUEST_METHOD}' not allowed".format_map(environ))
 
     def bet_app(self, environ, start_response):
         if environ['REQUEST_METHOD'] == "GET":
-            details = dict(
-                stake=self.table.bets  # 投注的信息
-            )
+            with self.lock:
+                details = dict(
+                    stake=dict(self.table.bets)  # 投注的信息
+                )
+            encode = lambda: wire.encode_bet_state(details['stake'])
         elif environ['REQUEST_METHOD'] == "POST":  # 定义投注的数据
             size = int(environ['CONTENT_LENGTH'])  # 字节流的长度
-            raw = environ['wsgi.input'].read(size).decode("UTF-8")  # 截取相应长度，然后解码
+            raw = environ['wsgi.input'].read(size)  # 截取相应长度
             try:
-                data = json.loads(raw)
+                if environ.get('CONTENT_TYPE') == wire.CONTENT_TYPE:
+                    data = [dict(bet=bet, amount=amount)
+                            for bet, amount in wire.decode_bet_request(raw)]
+                else:
+                    data = json.loads(raw.decode("UTF-8"))
                 if isinstance(data, dict):
                     data = [data]
-                for detail in data:
-                    self.table.place_bet(detail['bet'], int(detail['amount']))
+                bets = [(detail['bet'], int(detail['amount'])) for detail in data]
             except Exception as e:
                 raise RESTException("403 FORBIDDEN",
                                     "Bet {raw!r}".format(raw=raw))
-            details = dict(self.table.bets)
+
+            def apply():
+                for bet, amount in bets:
+                    self.table.place_bet(bet, amount)
+                return dict(self.table.bets)
+
+            def check():
+                # 保证任何状态都可以用二进制格式编码
+                try:
+                    wire.check_bets(self.table.bets, bets)
+                except ValueError as e:
+                    raise RESTException("403 FORBIDDEN",
+                                        "Bet {0}".format(e))
+            details = self.mutate([("bet", bet, amount) for bet, amount in bets], apply, check)
+            encode = lambda: wire.encode_bets(details)
         else:
             raise RESTException("405 METHOD_NOT_ALLOWED",
                                 "Method '{REQUEST_METHOD}' not allowed".format_map(environ))
 
-        status = '200 OK'
-        headers = [('Content-type', 'application/json; charset=utf-8')]
-        start_response(status, headers)
-        return [json.dumps(details).encode('UTF-8')]
+        return self.respond(environ, start_response, details, encode)
 
     def wheel_app(self, environ, start_response):
         if environ['REQUEST_METHOD'] == 'POST':
-            size = int(environ['CONTENT_LENGTH'])
+            size = environ.get('CONTENT_LENGTH', '')
             # """确认无参，如果有参，读取并忽略数据，这样避免套接字崩溃"""
-            if size != '':
-                raw = environ['wsgi.input'].read(size).decode("UTF-8")
+            if size not in ('', '0'):
+                raw = environ['wsgi.input'].read(int(size)).decode("UTF-8")
                 raise RESTException("403 FORBIDDEN",
-                              "Data '{raw!r}' not allowed".format_map(raw=raw))
-            spin = self.wheel.spin()
-            payout = self.table.resolve(spin)
-            self.rounds += 1
-            details = dict(
-                spin=spin,
-                payout=payout,
-                stake=self.table.stake,
-                rounds=self.rounds
-            )
-            status = '200 OK'
-            headers = [('Content-type', 'application/json; charset=utf-8')]
-            start_response(status, headers)
-            return [json.dumps(details).encode('UTF-8')]
+                                    "Data '{raw!r}' not allowed".format(raw=raw))
+            # ?count=N 批量转动N次，返回列表；所有转动只需要一次fsync
+            query = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+            try:
+                count = int(query['count'][0]) if 'count' in query else None
+            except ValueError:
+                count = 0
+            if count is not None and not 1 <= count <= self.max_spins:
+                raise RESTException("403 FORBIDDEN",
+                                    "count must be 1 to {0}".format(self.max_spins))
+            spins = [self.wheel.spin() for c in range(count or 1)]
+
+            def apply():
+                results = []
+                for spin in spins:
+                    payout = self.table.resolve(spin)
+                    self.rounds += 1
+                    results.append((spin, payout, self.table.stake, self.rounds))
+                return results
+            results = self.mutate([("spin", spin) for spin in spins], apply)
+            details = [
+                dict(spin=spin, payout=payout, stake=stake, rounds=rounds)
+                for spin, payout, stake, rounds in results
+            ]
+            if count is None:
+                return self.respond(environ, start_response, details[0],
+                                    lambda: wire.encode_wheel(*results[0]))
+            return self.respond(environ, start_response, details,
+                                lambda: wire.encode_stream([wire.encode_wheel(*result)
+                                                            for result in results]))
         else:
             raise RESTException("405 METHOD_NOT_ALLOWED",
                                 "Method '{REQUEST_METHOD}' not allowed".format_map(environ))
 
 # 创建roulette服务器
-def roulette_server_00(count=1):
-    from wsgiref.simple_server import make_server
+def roulette_server_00(count=1, directory=None):
+    """directory是日志和快照所在的目录，为None时不做持久化"""
+    import socketserver
+    from wsgiref.simple_server import make_server, WSGIServer
     from wsgiref.validate import validator
-    from wheel_game_12.Wheel_game import American
-    wheel = American()
-    roulette = Roulette(wheel)  # application
+    from wheel_game_12.Wheel_game import get_wheel
+    from wheel_game_12.journal import Journal
+
+    class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+        """每个请求一个线程，并发的请求才能共用一次fsync；server_close()会等待这些线程结束"""
+
+    wheel = get_wheel("american")
+    journal = Journal(directory) if directory else None
+    roulette = Roulette(wheel, journal)  # application
     debug = validator(roulette)  # 验证应用程序使用的接口
-    httpd = make_server('', 8080, debug)
-    if count is None:
-        httpd.serve_forever()
-    else:
-        for c in range(count):
-            httpd.handle_request()
+    httpd = make_server('', 8080, debug, server_class=ThreadingWSGIServer)
+    try:
+        if count is None:
+            httpd.serve_forever()
+        else:
+            for c in range(count):
+                httpd.handle_request()
+    finally:
+        httpd.server_close()
+        if journal:
+            journal.close()
 
 
 if __name__ == '__main__':
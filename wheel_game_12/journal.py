@@ -0,0 +1,412 @@
+"""
+预写日志(write-ahead journal)和快照，用于持久化Table/Roulette的状态
+
+- 日志：只追加的事件记录(投注bet、转动spin)，每条记录是 长度前缀 + pickle字节流
+- 组提交(group commit)：请求先写日志记录再修改状态，然后在commit()中等待覆盖它的那次fsync，
+  等到之后才返回响应。第一个等待者(leader)在sync_interval内等待其他并发请求加入同一批，
+  所以多线程服务器中很多请求共用一次fsync；单个请求里的批量投注、批量转动也只需要一次fsync
+- fsync失败：截断未确认的记录，之后拒绝所有写入
+- 快照：每隔snapshot_interval条事件，保存一次完整状态，然后清空日志
+- 恢复：加载最新快照，只重放快照之后的日志尾部
+"""
+
+import os
+import io
+import time
+import struct
+import pickle
+import threading
+
+
+class RestrictedUnpickler(pickle.Unpickler):
+    """日志和快照里只有内置的简单类型，禁止加载任何全局名称"""
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(
+            "global '{module}.{name}' is forbidden".format(module=module,
+                                                           name=name)
+        )
+
+
+def restricted_loads(data):
+    return RestrictedUnpickler(io.BytesIO(data)).load()
+
+
+class Journal:
+    """Roulette状态的预写日志，可以被多线程服务器中的多个请求同时使用"""
+    header = struct.Struct("<I")  # 每条记录的长度前缀
+
+    def __init__(self, directory, snapshot_interval=1000, batch_size=64, sync_interval=0.002):
+        self.directory = directory
+        self.journal_path = os.path.join(directory, "journal.log")
+        self.snapshot_path = os.path.join(directory, "snapshot.p")
+        self.snapshot_interval = snapshot_interval  # 多少条事件之后做一次快照
+        self.batch_size = batch_size  # 一批最多等待多少条记录
+        self.sync_interval = sync_interval  # leader最多等待其他请求多少秒
+        self.seq = 0  # 最后一条事件的序号
+        self.durable_seq = 0  # 已经fsync的最后一条事件的序号
+        self.since_snapshot = 0
+        self.active = 0  # 正在处理的修改请求数
+        self.waiting = 0  # 正在commit()中等待的请求数
+        self.syncing = False  # 是否有leader正在fsync
+        self.failed = None  # fsync失败后记录异常，之后拒绝写入
+        self.syncs = 0  # fsync的次数
+        self.cond = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self.target = open(self.journal_path, "ab")
+        self.durable_size = self.target.tell()  # 已经fsync的日志长度
+
+    def _check(self):
+        if self.failed:
+            raise OSError("Journal failed: {0}".format(self.failed))
+
+    def _fail(self, error):
+        """fsync失败：丢弃所有未确认的记录，之后拒绝写入，避免重启时重放客户端认为失败的请求"""
+        self.failed = error
+        try:
+            self.target.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.journal_path, self.durable_size)
+        except OSError:
+            pass
+        self.cond.notify_all()
+
+    def _append(self, event):
+        with self.cond:
+            self._check()
+            payload = pickle.dumps((self.seq + 1,) + event)
+            try:
+                self.target.write(self.header.pack(len(payload)) + payload)
+            except OSError as e:
+                self._fail(e)
+                raise
+            self.seq += 1
+            self.since_snapshot += 1
+            if self.seq - self.durable_seq >= self.batch_size:
+                self.cond.notify_all()
+            return self.seq
+
+    def bet(self, name, amount):
+        return self._append(("bet", name, amount))
+
+    def spin(self, spin):
+        return self._append(("spin", spin))
+
+    def begin(self):
+        """一个修改请求开始，leader会等它加入同一批"""
+        with self.cond:
+            self.active += 1
+
+    def end(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    @staticmethod
+    def _fsync(fd):
+        os.fsync(fd)
+
+    def _sync_locked(self):
+        """持有cond并且syncing为True时调用；fsync期间释放cond，其他请求可以继续写入"""
+        target_seq = self.seq
+        try:
+            self.target.flush()
+            size = self.target.tell()
+            fd = self.target.fileno()
+        except OSError as e:
+            self._fail(e)
+            raise
+        error = None
+        self.cond.release()
+        try:
+            self._fsync(fd)
+        except OSError as e:
+            error = e
+        finally:
+            self.cond.acquire()
+        if error:
+            self._fail(error)
+            raise error
+        self.syncs += 1
+        self.durable_seq, self.durable_size = target_seq, size
+
+    def commit(self, seq):
+        """组提交：等待包含seq的那次fsync完成。
+        第一个等待者成为leader，在sync_interval内等待其他正在处理的请求写入记录，
+        然后一次fsync确认整批记录；其他等待者只需要等leader完成"""
+        with self.cond:
+            self.waiting += 1
+            self.cond.notify_all()
+            try:
+                while self.durable_seq < seq:
+                    self._check()
+                    if self.syncing:
+                        self.cond.wait()
+                        continue
+                    self.syncing = True
+                    try:
+                        deadline = time.monotonic() + self.sync_interval
+                        while (self.active > self.waiting and
+                               self.seq - self.durable_seq < self.batch_size):
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self.cond.wait(remaining)
+                        self._sync_locked()
+                    finally:
+                        self.syncing = False
+                        self.cond.notify_all()
+            finally:
+                self.waiting -= 1
+
+    def sync(self):
+        """立即确认所有已写入的记录，快照和关闭时使用"""
+        with self.cond:
+            while self.syncing:
+                self.cond.wait()
+            self._check()
+            if self.durable_seq < self.seq:
+                self.syncing = True
+                try:
+                    self._sync_locked()
+                finally:
+                    self.syncing = False
+                    self.cond.notify_all()
+
+    def snapshot_due(self):
+        return self.since_snapshot >= self.snapshot_interval
+
+    @staticmethod
+    def _write_snapshot(path, state):
+        with open(path, "wb") as target:
+            pickle.dump(state, target)
+            target.flush()
+            os.fsync(target.fileno())
+
+    def snapshot(self, roulette):
+        """保存完整状态，然后清空日志；快照中的seq用来跳过已包含的日志记录。
+        调用方必须持有roulette.lock，保证状态和seq一致"""
+        with self.cond:
+            self.sync()
+            state = dict(
+                seq=self.seq,
+                stake=roulette.table.stake,
+                bets=dict(roulette.table.bets),
+                rounds=roulette.rounds,
+            )
+            temp_path = self.snapshot_path + ".tmp"
+            self._write_snapshot(temp_path, state)  # 失败时日志不变，下次再试
+            os.replace(temp_path, self.snapshot_path)  # 原子替换旧快照
+            try:
+                self.target.close()
+                self.target = open(self.journal_path, "wb")
+            except OSError as e:
+                self._fail(e)
+                raise
+            self.durable_size = 0
+            self.since_snapshot = 0
+
+    def _records(self):
+        """读取日志中的记录，遇到写了一半的尾部记录就停止"""
+        with open(self.journal_path, "rb") as source:
+            data = source.read()
+        offset = 0
+        self.valid_size = 0
+        while offset + self.header.size <= len(data):
+            size, = self.header.unpack_from(data, offset)
+            start = offset + self.header.size
+            if start + size > len(data):
+                break
+            try:
+                record = restricted_loads(data[start:start + size])
+            except (pickle.UnpicklingError, EOFError, ValueError):
+                break
+            yield record
+            offset = start + size
+            self.valid_size = offset
+
+    def restore(self, roulette):
+        """加载最新快照，然后重放日志尾部"""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as source:
+                state = RestrictedUnpickler(source).load()
+            self.seq = state['seq']
+            roulette.table.stake = state['stake']
+            roulette.table.bets.clear()
+            roulette.table.bets.update(state['bets'])
+            roulette.rounds = state['rounds']
+        for seq, kind, *args in self._records():
+            if seq <= self.seq:  # 已经包含在快照里
+                continue
+            if kind == "bet":
+                roulette.table.place_bet(*args)
+            elif kind == "spin":
+                roulette.table.resolve(*args)
+                roulette.rounds += 1
+            self.seq = seq
+            self.since_snapshot += 1
+        self.target.truncate(self.valid_size)  # 丢弃写了一半的尾部记录
+        self.durable_seq, self.durable_size = self.seq, self.valid_size
+
+    def close(self):
+        if self.failed:
+            return
+        self.sync()
+        self.target.close()
+
+
+# 演示并检查恢复过程
+def _request(roulette, method, path, data=None):
+    """在进程内调用Roulette，不启动服务器"""
+    import json
+    from wsgiref.util import setup_testing_defaults
+    body = json.dumps(data).encode('UTF-8') if data else b""
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(REQUEST_METHOD=method, PATH_INFO=path,
+                   CONTENT_LENGTH=str(len(body)) if body else "")
+    environ['wsgi.input'] = io.BytesIO(body)
+    response = []
+    body = b"".join(roulette(environ, lambda status, headers, exc_info=None: response.append(status)))
+    return response[0], body
+
+
+def _state(roulette):
+    return roulette.table.stake, dict(roulette.table.bets), roulette.rounds
+
+
+def demo():
+    import tempfile
+    from wheel_game_12.game_server import Roulette
+    from wheel_game_12.Wheel_game import American
+
+    def play(roulette, rounds):
+        for r in range(rounds):
+            _request(roulette, "POST", "/bet/", [{'bet': 'Red', 'amount': 2},
+                                                 {'bet': '17', 'amount': 1}])
+            _request(roulette, "POST", "/wheel/")
+        _request(roulette, "POST", "/bet/", {'bet': 'Black', 'amount': 5})
+
+    wheel = American()
+    wheel.rng.seed(42)
+    with tempfile.TemporaryDirectory() as directory:
+        # 1 快照 + 日志尾部重放；不调用close()，模拟进程崩溃
+        roulette = Roulette(wheel, Journal(directory, snapshot_interval=7))
+        play(roulette, 10)
+        expected = _state(roulette)
+        restored = Roulette(wheel, Journal(directory))
+        assert os.path.exists(restored.journal.snapshot_path)
+        assert _state(restored) == expected, (_state(restored), expected)
+        assert restored.journal.seq == roulette.journal.seq
+        print("snapshot + tail", _state(restored))
+        restored.journal.close()
+        roulette.journal.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 2 os.replace()之后、清空日志之前崩溃：已经包含在快照里的记录必须跳过
+        roulette = Roulette(wheel, Journal(directory, snapshot_interval=1000))
+        play(roulette, 3)
+        roulette.journal.sync()
+        with open(roulette.journal.journal_path, "rb") as source:
+            old_journal = source.read()
+        roulette.journal.snapshot(roulette)
+        roulette.journal.close()
+        with open(roulette.journal.journal_path, "wb") as target:
+            target.write(old_journal)
+        restored = Roulette(wheel, Journal(directory))
+        assert _state(restored) == _state(roulette), (_state(restored), _state(roulette))
+        print("skip snapshot seq", _state(restored))
+        restored.journal.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 3 写了一半的尾部记录被丢弃，之后追加的记录仍然可以读取
+        roulette = Roulette(wheel, Journal(directory))
+        play(roulette, 2)
+        expected = _state(roulette)
+        roulette.journal.close()
+        with open(roulette.journal.journal_path, "ab") as target:
+            target.write(Journal.header.pack(100) + b"torn")
+        restored = Roulette(wheel, Journal(directory))
+        assert _state(restored) == expected, (_state(restored), expected)
+        _request(restored, "POST", "/bet/", {'bet': 'Odd', 'amount': 3})
+        again = Roulette(wheel, Journal(directory))
+        assert again.table.bets['Odd'] == 3, dict(again.table.bets)
+        print("torn tail", _state(again))
+        restored.journal.close()
+        again.journal.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 4 组提交：并发的请求共用fsync，所有请求在返回前都已经持久化
+        roulette = Roulette(wheel, Journal(directory, snapshot_interval=50))
+        threads, requests = 8, 25
+
+        def client():
+            for r in range(requests):
+                assert _request(roulette, "POST", "/bet/", {'bet': 'Red', 'amount': 1})[0] == '200 OK'
+                assert _request(roulette, "POST", "/wheel/")[0] == '200 OK'
+        workers = [threading.Thread(target=client) for t in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert roulette.rounds == threads * requests
+        restored = Roulette(wheel, Journal(directory))
+        assert _state(restored) == _state(roulette), (_state(restored), _state(roulette))
+        print("group commit {0} requests, {1} fsyncs".format(
+            2 * threads * requests, roulette.journal.syncs))
+        roulette.journal.close()
+        restored.journal.close()
+
+    class FailingJournal(Journal):
+        """第fail_at次fsync或写快照时失败"""
+        fail_at = None
+        snapshot_fail_at = None
+
+        def _fsync(self, fd):
+            self.fail_at -= 1
+            if self.fail_at == 0:
+                raise OSError("fsync failed")
+            os.fsync(fd)
+
+        def _write_snapshot(self, path, state):
+            self.snapshot_fail_at -= 1
+            if self.snapshot_fail_at == 0:
+                raise OSError("disk full")
+            Journal._write_snapshot(path, state)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 5 fsync失败：请求返回500，之后拒绝所有请求，重启后不会重放失败的请求
+        journal = FailingJournal(directory)
+        journal.fail_at, journal.snapshot_fail_at = 2, 0
+        roulette = Roulette(wheel, journal)
+        assert _request(roulette, "POST", "/bet/", {'bet': 'Black', 'amount': 1})[0] == '200 OK'
+        status, body = _request(roulette, "POST", "/bet/", {'bet': 'Red', 'amount': 5})
+        assert status == '500 INTERNAL_SERVER_ERROR', status
+        status, body = _request(roulette, "POST", "/bet/", {'bet': 'Odd', 'amount': 1})
+        assert status == '503 SERVICE_UNAVAILABLE', status
+        journal.close()
+        restored = Roulette(wheel, Journal(directory))
+        assert dict(restored.table.bets) == {'Black': 1}, dict(restored.table.bets)
+        print("fsync failure", _state(restored))
+        restored.journal.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 6 快照失败不影响已经提交的请求，下一次checkpoint重试
+        journal = FailingJournal(directory, snapshot_interval=2)
+        journal.fail_at, journal.snapshot_fail_at = 0, 1
+        roulette = Roulette(wheel, journal)
+        for bet in 'Red', 'Black':  # 第二个请求触发快照，第一次写快照失败
+            assert _request(roulette, "POST", "/bet/", {'bet': bet, 'amount': 1})[0] == '200 OK'
+        assert not os.path.exists(journal.snapshot_path)
+        assert _request(roulette, "POST", "/bet/", {'bet': 'Odd', 'amount': 1})[0] == '200 OK'
+        assert os.path.exists(journal.snapshot_path)
+        journal.close()
+        restored = Roulette(wheel, Journal(directory))
+        assert _state(restored) == _state(roulette), (_state(restored), _state(roulette))
+        print("snapshot retry", _state(restored))
+        restored.journal.close()
+
+
+if __name__ == '__main__':
+    demo()
@@ -10,14 +10,23 @@ import multiprocessing
 
 
 class Simulate:
-    """模拟操作"""
+    """模拟操作：table是轮盘名称，player是(投注名称, 金额, 局数)"""
     def __init__(self, table, player, samples):
         self.table = table
         self.player = player
         self.samples = samples
 
     def __iter__(self):
-        yield summaries
+        # 在工作进程中第一次使用时才创建轮盘
+        from wheel_game_12.Wheel_game import Table, get_wheel
+        wheel = get_wheel(self.table)
+        bet, amount, rounds = self.player
+        for sample in range(self.samples):
+            table = Table(100)
+            for r in range(rounds):
+                table.place_bet(bet, amount)
+                table.resolve(wheel.spin())
+            yield table.stake
 
 
 class Simulation(multiprocessing.Process):
@@ -54,31 +63,33 @@ class Summarize(multiprocessing.Process):
         print(self.__class__.__name__, "finish", count)
 
 
-setup_q = multiprocessing.SimpleQueue()
-result_q = multiprocessing.SimpleQueue()
-result = Summarize(result_q)
-result.start()
+def main():
+    setup_q = multiprocessing.SimpleQueue()
+    result_q = multiprocessing.SimpleQueue()
+    result = Summarize(result_q)
+    result.start()
 
-simulators = []
-for i in range(4):
-    sim = Simulation(setup_q, result_q)
-    sim.start()
-    simulators.append(sim)
+    simulators = []
+    for i in range(4):
+        sim = Simulation(setup_q, result_q)
+        sim.start()
+        simulators.append(sim)
 
+    # 批量生产请求
+    for table in "american", "european":
+        for bet in "Red", "Hi", "17":
+            player = (bet, 1, 100)
+            for sample in range(5):
+                setup_q.put((table, player))
 
-# 批量生产请求
-table = Table(
-    decks=6, limit=50, dealer=Hit17(),
-    split=ReSplit(), payout=(3, 2))
-for bet in Flat, Martingale, OneThreeTwoSix:
-    player = Player(SomeStrategy, bet(), 100, 25)
-    for sample in range(5):
-        setup_q.put(table, player)
+    for sim in simulators:
+        setup_q.put((None, None))  # 添加哨兵对象
+    for sim in simulators:
+        sim.join()
 
-for sim in simulators:
-    setup_q.put((None, None))  # 添加哨兵对象
-for sim in simulators:
-    sim.join()
+    result_q.put((None, None, None))
+    result.join()
 
-result_q.put((None, None, None))
-result.join()
\ No newline at end of file
+
+if __name__ == '__main__':
+    main()
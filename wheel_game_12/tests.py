@@ -1,7 +1,5 @@
 # 演示RESTful服务并创建单元测试
-import time
 import json
-import concurrent.futures
 
 from wheel_game_12.Wheel_game import json_get
 from wheel_game_12.game_server import roulette_server, roulette_server_00
@@ -19,23 +17,31 @@ from wheel_game_12.game_server import roulette_server, roulette_server_00
 ########################
 
 import http.client
+from wheel_game_12 import wire
 
-def roulette_client(method="GET", path="/", data=None):
+def roulette_client(method="GET", path="/", data=None, binary=False):
+    """binary=True时使用wire.py中的二进制格式，data是 (投注名称, 金额) 的序列"""
     rest = http.client.HTTPConnection('localhost', 8080)
+    header = {'Accept': wire.CONTENT_TYPE} if binary else {}
     if data:
-        header = {'Content-type': 'application/json; charset=utf-8'}
-        params = json.dumps(data).encode('UTF-8')
+        if binary:
+            header['Content-type'] = wire.CONTENT_TYPE
+            params = wire.encode_bet_request(data)
+        else:
+            header['Content-type'] = 'application/json; charset=utf-8'
+            params = json.dumps(data).encode('UTF-8')
         rest.request(method, path, params, header)
     else:
-        rest.request(method, path)
+        rest.request(method, path, headers=header)
     response = rest.getresponse()
     print(response.headers)
-    print(response.read())
-    raw = response.read().decode("UTF-8")
+    raw = response.read()
     print(response.status)
     if 200 <= response.status < 300:
-        print(raw)
-        document = json.loads(raw)
+        if response.getheader('Content-type') == wire.CONTENT_TYPE:
+            document = wire.decode(raw)
+        else:
+            document = json.loads(raw.decode("UTF-8"))
         print(11, document )
         return document
     else:
@@ -45,14 +51,21 @@ def roulette_client(method="GET", path="/", data=None):
         print(raw)
 
 
-with concurrent.futures.ProcessPoolExecutor() as executor:
-    executor.submit(roulette_server_00, 4)  # 请求4次
-    time.sleep(3)  # 等待服务器开启
-    print(1111)
-    print(roulette_client("GET", "/player/"))   # 查看玩家状态
-    print(2222)
-    print(roulette_client("POST", "/bet/", {'bet': 'Black', 'amount': 2}))  # 投注
-    print(3333)
-    print(roulette_client("GET", "/bet/"))  # 查看投注状态
-    print(4444)
-    print(roulette_client("POST", "/wheel/"))  # 转动轮盘
+def main():
+    import time
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        executor.submit(roulette_server_00, 4)  # 请求4次
+        time.sleep(3)  # 等待服务器开启
+        print(1111)
+        print(roulette_client("GET", "/player/"))   # 查看玩家状态
+        print(2222)
+        print(roulette_client("POST", "/bet/", {'bet': 'Black', 'amount': 2}))  # 投注
+        print(3333)
+        print(roulette_client("GET", "/bet/"))  # 查看投注状态
+        print(4444)
+        print(roulette_client("POST", "/wheel/"))  # 转动轮盘
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+紧凑的二进制传输格式
+
+客户端在请求头中设置 Accept: application/x-roulette 时，服务端返回struct记录，
+而不是JSON。每条消息第一个字节是消息类型，其余字段都是小端序：
+- SPIN:      bin编号
+- PLAYER:    stake(float)，rounds
+- BETS:      记录数，名称数，然后是 (投注编号, 金额) * 记录数，然后是名称表
+- BET_STATE: 和BETS相同，对应 GET /bet/ 的 {"stake": {...}}
+- WHEEL:     bin编号，stake，rounds，记录数，名称数，然后是 (投注编号, 金额, 是否赢) * 记录数，然后是名称表
+- STREAM:    消息数，然后是连续的消息，对应批量请求返回的JSON列表
+投注编号小于len(BET_NAMES)时就是BET_NAMES的下标；否则是名称表的下标加len(BET_NAMES)，
+名称表中每个名称是 长度 + UTF-8字节。这样记录都是定长的，可以用一次iter_unpack()解析。
+投注请求的请求体设置 Content-type: application/x-roulette 时，格式是 记录数，名称数，
+(投注编号, 金额) * 记录数，名称表。
+decode()返回的对象和对应JSON响应经json.loads()得到的对象相同，只是bin对象是共享的，不要修改。
+"""
+
+import struct
+import functools
+
+from wheel_game_12 import Wheel_game
+
+CONTENT_TYPE = "application/x-roulette"
+
+# 所有投注名称，列表下标就是投注编号；数字投注的编号也是bin编号
+BET_NAMES = [str(n) for n in range(37)] + ["00", "Red", "Black", "Hi", "Lo", "Even", "Odd"]
+BET_IDS = {name: i for i, name in enumerate(BET_NAMES)}
+OUTCOMES = ('lose', 'win')
+
+SPIN, PLAYER, BETS, BET_STATE, WHEEL, STREAM = range(1, 7)
+
+spin_record = struct.Struct("<BB")
+player_record = struct.Struct("<BdQ")
+bets_header = struct.Struct("<BHH")
+bet_request_header = struct.Struct("<HH")
+wheel_header = struct.Struct("<BBdQHH")
+stream_header = struct.Struct("<BI")
+name_header = struct.Struct("<H")
+bet_record = struct.Struct("<Hi")
+outcome_record = struct.Struct("<HiB")
+
+# 字段的范围，投注之后的状态必须在这个范围内才能编码
+MIN_AMOUNT, MAX_AMOUNT = -2 ** 31, 2 ** 31 - 1
+MAX_NAME = 0xFFFF  # 名称的UTF-8字节数
+MAX_BETS = 0xFFFF - len(BET_NAMES)  # 同时存在的投注数
+
+
+def accepts(environ):
+    """内容协商：解析Accept请求头，二进制格式的q值大于0并且不低于JSON的q值时返回True"""
+    quality = {}
+    for media_range in environ.get('HTTP_ACCEPT', '').split(','):
+        media_type, *params = media_range.split(';')
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[media_type.strip().lower()] = q
+    binary = quality.get(CONTENT_TYPE, 0.0)
+    return binary > 0 and binary >= quality.get('application/json', 0.0)
+
+
+def check_bets(bets, new_bets):
+    """投注之前检查：金额合计、名称长度和投注数都不能超过字段范围，否则抛出ValueError"""
+    totals = {}
+    for name, amount in new_bets:
+        totals[name] = totals.get(name, bets.get(name, 0)) + amount
+        if not MIN_AMOUNT <= totals[name] <= MAX_AMOUNT:
+            raise ValueError("Amount {0} out of range".format(totals[name]))
+        if len(name.encode('UTF-8')) > MAX_NAME:
+            raise ValueError("Bet name too long")
+    if len(bets) + sum(1 for name in totals if name not in bets) > MAX_BETS:
+        raise ValueError("Too many bets")
+
+
+def bin_id(spin):
+    """bin中赔率为35:1的就是数字投注"""
+    for name, odds in spin.items():
+        if tuple(odds) == (35, 1):
+            return BET_IDS[name]
+    raise ValueError("No number in bin {0!r}".format(spin))
+
+
+@functools.lru_cache(maxsize=None)
+def make_bin(bin_no):
+    """根据bin编号还原出和JSON格式一样的bin，每个编号只创建一次"""
+    number = BET_NAMES[bin_no]
+    if number in ("0", "00"):
+        return {number: [35, 1]}
+    n = int(number)
+    return {
+        number: [35, 1],
+        Wheel_game.Wheel.redblack(n): [1, 1],
+        Wheel_game.Wheel.hilo(n): [1, 1],
+        Wheel_game.Wheel.evenodd(n): [1, 1],
+    }
+
+
+def _bet_ids(names):
+    """返回 (投注编号列表, 名称表)"""
+    ids, extra = [], {}
+    for name in names:
+        if name in BET_IDS:
+            ids.append(BET_IDS[name])
+        else:
+            ids.append(len(BET_NAMES) + extra.setdefault(name, len(extra)))
+    return ids, extra
+
+
+def _encode_names(extra):
+    return b"".join(name_header.pack(len(raw)) + raw
+                    for raw in (name.encode('UTF-8') for name in extra))
+
+
+def _decode_names(data, offset, count):
+    """返回 (投注名称查找表, 新的偏移量)"""
+    if not count:
+        return BET_NAMES, offset
+    names = list(BET_NAMES)
+    for i in range(count):
+        size, = name_header.unpack_from(data, offset)
+        offset += name_header.size
+        names.append(bytes(data[offset:offset + size]).decode('UTF-8'))
+        offset += size
+    return names, offset
+
+
+def encode_spin(spin):
+    return spin_record.pack(SPIN, bin_id(spin))
+
+
+def encode_player(stake, rounds):
+    return player_record.pack(PLAYER, stake, rounds)
+
+
+def encode_bets(bets, tag=BETS):
+    """bets是 投注名称:金额 的dict"""
+    ids, extra = _bet_ids(bets)
+    return b"".join([
+        bets_header.pack(tag, len(bets), len(extra)),
+        b"".join(bet_record.pack(bet, amount) for bet, amount in zip(ids, bets.values())),
+        _encode_names(extra),
+    ])
+
+
+def encode_bet_state(bets):
+    return encode_bets(bets, BET_STATE)
+
+
+def encode_wheel(spin, payout, stake, rounds):
+    ids, extra = _bet_ids(bet for bet, amount, outcome in payout)
+    return b"".join([
+        wheel_header.pack(WHEEL, bin_id(spin), stake, rounds, len(payout), len(extra)),
+        b"".join(outcome_record.pack(bet, amount, outcome == 'win')
+                 for bet, (_, amount, outcome) in zip(ids, payout)),
+        _encode_names(extra),
+    ])
+
+
+def encode_stream(messages):
+    """messages是已经编码的消息列表"""
+    return stream_header.pack(STREAM, len(messages)) + b"".join(messages)
+
+
+def encode_bet_request(bets):
+    """客户端用：投注请求体，bets是 (投注名称, 金额) 的序列"""
+    ids, extra = _bet_ids(name for name, amount in bets)
+    return b"".join([
+        bet_request_header.pack(len(ids), len(extra)),
+        b"".join(bet_record.pack(bet, amount) for bet, (_, amount) in zip(ids, bets)),
+        _encode_names(extra),
+    ])
+
+
+def _decode_records(data, offset, record, count, names_count):
+    """解析定长记录和后面的名称表，返回 (记录列表, 投注名称查找表, 新的偏移量)"""
+    end = offset + record.size * count
+    records = record.iter_unpack(data[offset:end])
+    names, offset = _decode_names(data, end, names_count)
+    return records, names, offset
+
+
+def decode_bet_request(data):
+    """服务端用：解析投注请求体"""
+    data = memoryview(data)
+    count, names_count = bet_request_header.unpack_from(data)
+    records, names, offset = _decode_records(data, bet_request_header.size, bet_record,
+                                             count, names_count)
+    if offset != len(data):
+        raise ValueError("Trailing data in bet request")
+    return [(names[bet], amount) for bet, amount in records]
+
+
+def _decode_at(data, offset):
+    """解码从offset开始的一条消息，返回 (对象, 新的偏移量)"""
+    tag = data[offset]
+    if tag == SPIN:
+        _, bin_no = spin_record.unpack_from(data, offset)
+        return make_bin(bin_no), offset + spin_record.size
+    elif tag == PLAYER:
+        _, stake, rounds = player_record.unpack_from(data, offset)
+        return dict(stake=stake, rounds=rounds), offset + player_record.size
+    elif tag in (BETS, BET_STATE):
+        _, count, names_count = bets_header.unpack_from(data, offset)
+        records, names, offset = _decode_records(data, offset + bets_header.size, bet_record,
+                                                 count, names_count)
+        bets = {names[bet]: amount for bet, amount in records}
+        return (dict(stake=bets) if tag == BET_STATE else bets), offset
+    elif tag == WHEEL:
+        _, bin_no, stake, rounds, count, names_count = wheel_header.unpack_from(data, offset)
+        offset += wheel_header.size
+        if count:
+            records, names, offset = _decode_records(data, offset, outcome_record,
+                                                     count, names_count)
+            payout = [[names[bet], amount, OUTCOMES[win]] for bet, amount, win in records]
+        else:  # 批量转动时，第一次转动之后通常没有投注
+            payout = []
+        return dict(spin=make_bin(bin_no), payout=payout, stake=stake, rounds=rounds), offset
+    elif tag == STREAM:
+        _, count = stream_header.unpack_from(data, offset)
+        offset += stream_header.size
+        messages = []
+        for i in range(count):
+            message, offset = _decode_at(data, offset)
+            messages.append(message)
+        return messages, offset
+    raise ValueError("Unknown message type {0}".format(tag))
+
+
+def decode(data):
+    """客户端用：根据消息类型解码，返回和JSON格式相同结构的对象"""
+    document, offset = _decode_at(memoryview(data), 0)
+    return document
+
+
+# 演示并检查：每种消息的二进制解码结果和JSON结果相同
+def _request(app, method, path, body=b"", headers=()):
+    """在进程内调用WSGI应用程序，返回 (状态, 响应体)"""
+    import io
+    from wsgiref.util import setup_testing_defaults
+    path, _, query = path.partition("?")
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update(REQUEST_METHOD=method, PATH_INFO=path, QUERY_STRING=query,
+                   CONTENT_LENGTH=str(len(body)) if body else "")
+    environ.update(headers)
+    environ['wsgi.input'] = io.BytesIO(body)
+    response = []
+    body = b"".join(app(environ, lambda status, headers, exc_info=None: response.append(status)))
+    return response[0], body
+
+
+def demo():
+    import json
+    from wheel_game_12.game_server import Roulette
+
+    binary = {'HTTP_ACCEPT': CONTENT_TYPE}
+    bets = [("Red", 2), ("17", 1), ("Blue", 3)]  # Blue不在BET_NAMES中
+    json_bets = json.dumps([dict(bet=bet, amount=amount) for bet, amount in bets]).encode('UTF-8')
+    requests = [
+        ("GET", "/player/", None),  # PLAYER
+        ("POST", "/bet/", bets),  # BETS
+        ("GET", "/bet/", None),  # BET_STATE
+        ("POST", "/wheel/", None),  # WHEEL
+        ("POST", "/bet/", bets),
+        ("POST", "/wheel/?count=20", None),  # STREAM
+        ("GET", "/player/", None),
+    ]
+
+    def seeded():
+        wheel = Wheel_game.American()
+        wheel.rng.seed(42)
+        return wheel
+
+    as_json, as_binary = Roulette(seeded()), Roulette(seeded())
+    for method, path, data in requests:
+        if data:
+            status, json_raw = _request(as_json, method, path, json_bets)
+            binary_status, binary_raw = _request(as_binary, method, path, encode_bet_request(data),
+                                                 dict(binary, CONTENT_TYPE=CONTENT_TYPE))
+        else:
+            status, json_raw = _request(as_json, method, path)
+            binary_status, binary_raw = _request(as_binary, method, path, headers=binary)
+        assert status == binary_status == '200 OK', (status, binary_status)
+        assert json.loads(json_raw) == decode(binary_raw), (json.loads(json_raw), decode(binary_raw))
+        print("{0:4s} {1:18s} json {2:5d} bytes, binary {3:5d} bytes".format(
+            method, path, len(json_raw), len(binary_raw)))
+
+    # SPIN：Wheel可回调对象
+    status, json_raw = _request(seeded(), "GET", "/")
+    status, binary_raw = _request(seeded(), "GET", "/", headers=binary)
+    assert json.loads(json_raw) == decode(binary_raw)
+    print("GET  {0:18s} json {1:5d} bytes, binary {2:5d} bytes".format(
+        "/ (Wheel)", len(json_raw), len(binary_raw)))
+
+    # 超出字段范围的投注在修改状态之前被拒绝，所以任何状态都可以编码
+    roulette = Roulette(seeded())
+    for bet in dict(bet="Red", amount=2 ** 40), dict(bet="x" * (MAX_NAME + 1), amount=1):
+        status, body = _request(roulette, "POST", "/bet/", json.dumps(bet).encode('UTF-8'), binary)
+        assert status == '403 FORBIDDEN', status
+    assert not roulette.table.bets and decode(_request(roulette, "GET", "/bet/", headers=binary)[1])
+
+    # Accept请求头
+    for accept, expected in [(CONTENT_TYPE, True), (CONTENT_TYPE + "-v2", False),
+                             (CONTENT_TYPE + ";q=0", False),
+                             ("application/json, " + CONTENT_TYPE + ";q=0.5", False),
+                             ("text/html, " + CONTENT_TYPE + " ; q=0.9", True)]:
+        assert accepts({'HTTP_ACCEPT': accept}) == expected, accept
+
+    # 解析时间：decode()和json.loads()
+    import timeit
+    six_bets = json.dumps([dict(bet=bet, amount=2)
+                           for bet in ("Red", "Black", "Hi", "Lo", "17", "Even")]).encode('UTF-8')
+    for path, number in ("/wheel/", 20000), ("/wheel/?count=200", 500):
+        responses = []
+        for headers in (), binary:
+            roulette = Roulette(seeded())
+            _request(roulette, "POST", "/bet/", six_bets)
+            responses.append(_request(roulette, "POST", path, headers=headers)[1])
+        json_raw, binary_raw = responses
+        assert json.loads(json_raw) == decode(binary_raw)
+        json_time = timeit.timeit(lambda: json.loads(json_raw), number=number)
+        binary_time = timeit.timeit(lambda: decode(binary_raw), number=number)
+        print("parse {0:18s} json {1:.3f}s, binary {2:.3f}s ({3:.0%}) x {4}".format(
+            path, json_time, binary_time, binary_time / json_time, number))
+
+
+if __name__ == '__main__':
+    demo()